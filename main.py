@@ -1,11 +1,19 @@
 import uuid
-from src.agent_graph import app, initialize_knowledge_base
+from src.agent_graph import stream_turn, initialize_knowledge_base, get_route_stats
 from langchain_core.messages import HumanMessage
 from termcolor import colored
 
 def print_step(step_name):
     print(colored(f"   [Node Execution]: {step_name}", "cyan"))
 
+def print_route_stats():
+    stats = get_route_stats()
+    if not stats:
+        return
+    print(colored("\n--- 🧭 Route Stats ---", "white", attrs=['bold']))
+    for route, s in stats.items():
+        print(colored(f"{route}: {s['count']} turns, avg {s['avg_latency_s']:.2f}s, avg ${s['avg_cost_usd']:.5f} (router ${s['avg_router_cost_usd']:.5f})", "cyan"))
+
 def main():
     print(colored("🚀 Initializing Staff Agent System...", "green", attrs=['bold']))
     
@@ -23,6 +31,7 @@ def main():
     while True:
         user_input = input(colored("\nUser (You): ", "yellow"))
         if user_input.lower() in ["quit", "exit"]:
+            print_route_stats()
             break
             
         # Prepare state
@@ -38,59 +47,81 @@ def main():
         
         # Stream execution
         try:
-            for event in app.stream(inputs, config=config):
-                for key, value in event.items():
-                    nodes_traversed.append(key)
-                    print_step(key)
+            streaming = False
+            streamed_synthesis = False
+            for kind, payload in stream_turn(inputs, config):
+                if kind == "token":
+                    # Synthesis tokens are printed as they arrive
+                    if not streaming:
+                        print(colored("\n📝 Synthesis: ", "green", attrs=['bold']), end="", flush=True)
+                        streaming = True
+                    streamed_synthesis = True
+                    print(colored(payload, "green"), end="", flush=True)
+                    continue
+
+                key, value = payload
+                if streaming:
+                    print()
+                    streaming = False
+                nodes_traversed.append(key)
+                print_step(key)
+                value = value or {}
+                
+                # Debugging output for specific nodes
+                if key in ["research_tools", "ops_tools"]:
+                    # Inspect tool output
+                    last_msg = value['messages'][-1]
+                    tool_name = getattr(last_msg, 'name', 'unknown_tool')
+                    tools_used.append(tool_name)
+                    print(colored(f"      Tool Used: {tool_name}", "magenta"))
+                    print(colored(f"      Tool Result: {last_msg.content[:100]}...", "magenta"))
                     
-                    # Debugging output for specific nodes
-                    if key in ["research_tools", "ops_tools"]:
-                        # Inspect tool output
-                        last_msg = value['messages'][-1]
-                        tool_name = getattr(last_msg, 'name', 'unknown_tool')
-                        tools_used.append(tool_name)
-                        print(colored(f"      Tool Used: {tool_name}", "magenta"))
-                        print(colored(f"      Tool Result: {last_msg.content[:100]}...", "magenta"))
-                        
-                        if tool_name == "search_knowledge_base":
-                            context_retrieved = last_msg.content[:200] + "..." if len(last_msg.content) > 200 else last_msg.content
+                    if tool_name == "search_knowledge_base":
+                        context_retrieved = last_msg.content[:200] + "..." if len(last_msg.content) > 200 else last_msg.content
 
-                    if key == "planner_node":
-                        plan = value.get("plan")
-                        if plan:
-                            if plan.response:
-                                print(colored(f"\n📝 Direct Response: {plan.response}", "green", attrs=['bold']))
-                                final_answer = plan.response
-                            else:
-                                print(colored(f"   [Planner]: Generated {len(plan.tasks)} tasks", "cyan", attrs=['bold']))
-                                for task in plan.tasks:
-                                    print(colored(f"      - Task {task.id}: {task.description} (Agent: {task.assigned_agent})", "cyan"))
+                if key == "router_node":
+                    route = value.get("route")
+                    print(colored(f"   [Router]: Route: {route}", "cyan"))
 
-                    if key == "scheduler_node":
-                        # Scheduler doesn't output much unless we want to see what's scheduled
-                        pass
+                if key in ["router_node", "planner_node"]:
+                    plan = value.get("plan")
+                    if plan:
+                        if plan.response:
+                            print(colored(f"\n📝 Direct Response: {plan.response}", "green", attrs=['bold']))
+                            final_answer = plan.response
+                        else:
+                            print(colored(f"   [Planner]: Generated {len(plan.tasks)} tasks", "cyan", attrs=['bold']))
+                            for task in plan.tasks:
+                                print(colored(f"      - Task {task.id}: {task.description} (Agent: {task.assigned_agent})", "cyan"))
 
-                    if key in ["research_agent", "ops_agent"]:
-                        # Workers now return 'results', not messages
-                        results = value.get("results", {})
-                        for task_id, result in results.items():
-                            print(colored(f"\n{key} (Task {task_id}): {result[:200]}...", "green", attrs=['bold']))
-                    
-                    if key == "synthesis_node":
-                        final_answer = value['messages'][-1].content
+                if key == "scheduler_node":
+                    # Scheduler doesn't output much unless we want to see what's scheduled
+                    pass
+
+                if key in ["research_agent", "ops_agent"]:
+                    # Workers now return 'results', not messages
+                    results = value.get("results", {})
+                    for task_id, result in results.items():
+                        print(colored(f"\n{key} (Task {task_id}): {result[:200]}...", "green", attrs=['bold']))
+                
+                if key == "synthesis_node":
+                    # Usually already streamed token by token, keep the full text for the trace
+                    final_answer = value['messages'][-1].content
+                    if not streamed_synthesis:
+                        # Non-streamed call (e.g. cache hit): the whole message arrives only here
                         print(colored(f"\n📝 Synthesis: {final_answer}", "green", attrs=['bold']))
+                    streamed_synthesis = False
 
-                    if key == "verification_node":
-                        if 'messages' in value:
-                            audit_res = value['messages'][-1].content
-                            print(colored(f"\n📝 {audit_res}", "yellow"))
-                        else:
-                            print(colored(f"\n📝 Verification Skipped", "yellow"))
+                if key == "verification_node":
+                    # Only interrupt the user when the streamed answer failed the audit
+                    if value.get("verification_status") == "FAIL":
+                        audit_res = value['messages'][-1].content
+                        print(colored(f"\n⚠️  The answer above failed verification, a revised answer follows.\n📝 {audit_res}", "yellow"))
 
-                    if key == "retry_node":
-                        critique = value['messages'][-1].content
-                        print(colored(f"\n🔄 RETRY TRIGGERED: {critique}", "red", attrs=['bold']))
-            
+                if key == "retry_node":
+                    critique = value['messages'][-1].content
+                    print(colored(f"\n🔄 RETRY TRIGGERED: {critique}", "red", attrs=['bold']))
+        
             # Print Workflow Summary
             print(colored("\n--- 📊 Workflow Trace ---", "white", attrs=['bold']))
             print(colored(f"Nodes Traversed: { ' -> '.join(nodes_traversed) }", "cyan"))
@@ -1,8 +1,9 @@
 import operator
+import re
 from typing import Annotated, List, TypedDict, Union, Literal, Optional
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage, ToolMessage
 from langchain_core.tools import tool
 from langgraph.graph import StateGraph, END, START
 from langgraph.prebuilt import ToolNode
@@ -10,6 +11,7 @@ from langgraph.checkpoint.sqlite import SqliteSaver
 from dotenv import load_dotenv
 
 from src.graph_rag import KnowledgeGraphRetriever
+from src.sharded_rag import ShardedKnowledgeGraphRetriever
 from src.tools import calculate, check_system_status
 from langchain_groq import ChatGroq
 from termcolor import colored
@@ -17,29 +19,46 @@ from termcolor import colored
 
 import getpass
 import os
+import time
 
 
 
 load_dotenv()
 
 # 1. Initialize Components
-llm_planner = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0)
-llm_flash = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
-kg = KnowledgeGraphRetriever()
-
-@tool
-def search_knowledge_base(query: str) -> str:
+PLANNER_MODEL = "gemini-2.5-pro"
+FLASH_MODEL = "gemini-2.5-flash"
+llm_planner = ChatGoogleGenerativeAI(model=PLANNER_MODEL, temperature=0)
+llm_flash = ChatGoogleGenerativeAI(model=FLASH_MODEL, temperature=0)
+if os.environ.get("KB_SHARDED") == "1":
+    kg = ShardedKnowledgeGraphRetriever(vector_backend=os.environ.get("VECTOR_BACKEND", "faiss"))
+else:
+    kg = KnowledgeGraphRetriever(vector_backend=os.environ.get("VECTOR_BACKEND", "faiss"))
+
+def search_knowledge_base(query: str, shard: Optional[str] = None) -> str:
     """
     Search the LOCAL internal knowledge base for relevant information.
     This is NOT an internet search. It searches our internal documents.
     ALWAYS use this tool for any query about Nexus, models, specs, or internal systems.
     """
-    print(f"   ... 🔍 Graph Retrieval for: '{query}'")
-    retrieved_data = kg.retrieve(query, hops=1)
+    print(f"   ... 🔍 Graph Retrieval for: '{query}'" + (f" (shard: {shard})" if shard else ""))
+    if shard and isinstance(kg, ShardedKnowledgeGraphRetriever):
+        if shard not in kg.shards:
+            return f"Unknown shard '{shard}'. Available shards: {', '.join(kg.shard_names)}. Leave shard empty to search everything."
+        retrieved_data = kg.retrieve(query, hops=1, shards=[shard])
+    else:
+        retrieved_data = kg.retrieve(query, hops=1)
     if not retrieved_data:
         return "No relevant context found."
     return retrieved_data
 
+# The shard list in the tool description follows the configured shards
+if isinstance(kg, ShardedKnowledgeGraphRetriever):
+    search_knowledge_base.__doc__ = search_knowledge_base.__doc__.rstrip() + (
+        f"\n    Optionally restrict the search to one shard: {kg.describe_shards()}. Leave empty to search everything.\n    "
+    )
+search_knowledge_base = tool(search_knowledge_base)
+
 # Define Tool Sets
 research_tools = [search_knowledge_base]
 ops_tools = [calculate, check_system_status]
@@ -65,6 +84,72 @@ class Plan(BaseModel):
     tasks: List[Task] = Field(default_factory=list)
     response: Optional[str] = Field(default=None, description="Direct response for greetings or simple questions that don't need tools.")
 
+class RouteDecision(BaseModel):
+    route: Literal["direct", "single_task", "multi_task"]
+    confidence: float = Field(description="How sure you are about the chosen route, from 0.0 to 1.0.")
+    response: Optional[str] = Field(default=None, description="Answer for the user when route is 'direct'.")
+    assigned_agent: Optional[Literal["ResearchAgent", "OpsAgent"]] = Field(default=None, description="Agent for the task when route is 'single_task'.")
+    task_description: Optional[str] = Field(default=None, description="Task description when route is 'single_task'.")
+
+# Model cascade: the flash router answers trivial turns and single-task requests,
+# everything else (or anything it is unsure about) falls through to the pro planner.
+ROUTER_CONFIDENCE_THRESHOLD = float(os.environ.get("ROUTER_CONFIDENCE_THRESHOLD", "0.75"))
+ROUTER_MAX_WORDS = int(os.environ.get("ROUTER_MAX_WORDS", "40"))
+MULTI_TASK_MARKERS = re.compile(r"\b(and then|after that|based on|which .+ (?:is|was|are|were) .+ by|compare|versus|vs\.?)\b", re.IGNORECASE)
+
+# USD per 1M tokens (input, output), used for the per-route cost counters
+MODEL_PRICING = {
+    PLANNER_MODEL: (1.25, 10.00),
+    FLASH_MODEL: (0.30, 2.50),
+}
+
+route_stats = {} # {route: {"count": int, "latency_s": float, "cost_usd": float, "router_latency_s": float, "router_cost_usd": float}}
+
+def record_route(route: str, latency: float, cost: float, router_latency: float = 0.0, router_cost: float = 0.0):
+    """
+    Records one finished turn under its final route. `latency` and `cost` cover
+    the whole turn, the router share is kept separately for threshold tuning.
+    """
+    stats = route_stats.setdefault(route, {"count": 0, "latency_s": 0.0, "cost_usd": 0.0, "router_latency_s": 0.0, "router_cost_usd": 0.0})
+    stats["count"] += 1
+    stats["latency_s"] += latency
+    stats["cost_usd"] += cost
+    stats["router_latency_s"] += router_latency
+    stats["router_cost_usd"] += router_cost
+
+def get_route_stats() -> dict:
+    """
+    Returns the per-route counters with average latency and cost per turn.
+    """
+    summary = {}
+    for route, stats in route_stats.items():
+        count = stats["count"] or 1
+        summary[route] = {
+            **stats,
+            "avg_latency_s": stats["latency_s"] / count,
+            "avg_cost_usd": stats["cost_usd"] / count,
+            "avg_router_cost_usd": stats["router_cost_usd"] / count,
+        }
+    return summary
+
+def estimate_cost(model: str, raw_message) -> float:
+    usage = getattr(raw_message, "usage_metadata", None) or {}
+    price_in, price_out = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (usage.get("input_tokens", 0) * price_in + usage.get("output_tokens", 0) * price_out) / 1_000_000
+
+def usage_update(model: str, *messages) -> dict:
+    return {"cost_usd": sum(estimate_cost(model, m) for m in messages)}
+
+def looks_multi_task(user_request: str) -> bool:
+    """
+    Cheap local check for requests that obviously need the pro planner.
+    """
+    if len(user_request.split()) > ROUTER_MAX_WORDS:
+        return True
+    if user_request.count("?") > 1:
+        return True
+    return bool(MULTI_TASK_MARKERS.search(user_request))
+
 def smart_merge_results(current: dict, update: dict) -> dict:
     """
     Smart reducer for results that handles turn-based clearing.
@@ -76,6 +161,18 @@ def smart_merge_results(current: dict, update: dict) -> dict:
     # Normal merge - combine current and update
     return {**current, **update}
 
+def add_usage(current: dict, update: dict) -> dict:
+    """
+    Reducer summing per-turn LLM usage from every node (including parallel workers).
+    A '__turn__' key resets the totals at the start of a turn.
+    """
+    if "__turn__" in update:
+        return {k: v for k, v in update.items() if k != "__turn__"}
+    merged = dict(current or {})
+    for k, v in update.items():
+        merged[k] = merged.get(k, 0.0) + v
+    return merged
+
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
     plan: Plan
@@ -84,15 +181,17 @@ class AgentState(TypedDict):
     verification_status: str # "PASS", "FAIL", or "SKIPPED"
     next: str # For Supervisor routing (legacy, kept for now)
     turn_id: int # Track conversation turns
+    route: str # "direct", "single_task", "multi_task" or "low_confidence"
+    turn_started: float # Wall-clock start of the current turn
+    usage: Annotated[dict, add_usage] # {"cost_usd", "router_latency_s", "router_cost_usd"} for the current turn
 
 # 3. Define Nodes
 
-def planner_node(state: AgentState):
+def turn_update(state: AgentState) -> dict:
     """
-    Analyzes the user request and generates a plan of tasks.
+    Signals a turn change so results from the previous turn are cleared.
     """
     messages = state["messages"]
-    user_request = messages[-1].content
     
     # Calculate current turn ID based on number of HumanMessages
     current_turn = sum(1 for m in messages if isinstance(m, HumanMessage))
@@ -100,6 +199,91 @@ def planner_node(state: AgentState):
     
     # Clear results if this is a new turn
     clear_results = (current_turn != previous_turn)
+    return {
+        "results": {"__turn__": True} if clear_results else {},
+        "turn_id": current_turn
+    }
+
+def router_node(state: AgentState):
+    """
+    Cheap routing stage in front of the planner.
+    Answers direct turns and builds single-task plans with the flash model,
+    escalating multi-task or low-confidence requests to the pro planner.
+    """
+    messages = state["messages"]
+    user_request = messages[-1].content
+    turn_started = time.time()
+    started = time.perf_counter()
+    
+    def routed(route: str, step: str, cost: float = 0.0) -> dict:
+        # Starts the turn's usage totals with the router's own share
+        return {
+            "route": route,
+            "steps": [step],
+            "turn_started": turn_started,
+            "usage": {"__turn__": True, "cost_usd": cost, "router_latency_s": time.perf_counter() - started, "router_cost_usd": cost}
+        }
+    
+    if looks_multi_task(user_request):
+        print(colored("   [Router]: Multi-task request detected locally, escalating to planner.", "cyan"))
+        return routed("multi_task", "routing_escalated_local")
+    
+    router_prompt = (
+        "You are a Router. Classify the user's latest request into one of three routes:\n"
+        "- 'direct': greetings, chitchat, or questions already answered in the conversation history. Fill 'response' with the answer.\n"
+        "- 'single_task': exactly one lookup or one operation. Fill 'assigned_agent' and 'task_description'.\n"
+        "  ResearchAgent searches the internal knowledge base (specs, docs, internal systems).\n"
+        "  OpsAgent calculates values or checks system status.\n"
+        "- 'multi_task': anything that needs several steps, several agents, or results that depend on each other.\n"
+        "Requests needing NEW knowledge that is not in the history are never 'direct'.\n"
+        "Set 'confidence' to how sure you are about the route."
+    )
+    
+    router_llm = llm_flash.with_structured_output(RouteDecision, include_raw=True)
+    
+    try:
+        output = router_llm.invoke([SystemMessage(content=router_prompt)] + messages)
+    except Exception as e:
+        print(colored(f"   [ERROR] Router failed: {str(e)}. Escalating to planner.", "red"))
+        return routed("low_confidence", "routing_failed")
+    
+    decision = output["parsed"]
+    cost = estimate_cost(FLASH_MODEL, output["raw"])
+    
+    incomplete = decision is not None and (
+        (decision.route == "direct" and not decision.response)
+        or (decision.route == "single_task" and not (decision.assigned_agent and decision.task_description))
+    )
+    if decision is None or incomplete or decision.confidence < ROUTER_CONFIDENCE_THRESHOLD:
+        print(colored("   [Router]: Low confidence, escalating to planner.", "cyan"))
+        return routed("low_confidence", "routing_escalated_low_confidence", cost)
+    
+    if decision.route == "multi_task":
+        print(colored(f"   [Router]: Multi-task request (confidence {decision.confidence:.2f}), escalating to planner.", "cyan"))
+        return routed("multi_task", "routing_escalated", cost)
+    
+    if decision.route == "direct":
+        print(colored(f"   [Router]: Direct Response: {decision.response}", "cyan", attrs=['bold']))
+        return {
+            **routed("direct", "routing_complete_direct", cost),
+            **turn_update(state),
+            "plan": Plan(response=decision.response),
+            "messages": [AIMessage(content=decision.response)]
+        }
+    
+    task = Task(id=1, description=decision.task_description, assigned_agent=decision.assigned_agent)
+    print(colored(f"   [Router]: Single task: {task.description} (Agent: {task.assigned_agent})", "cyan", attrs=['bold']))
+    return {
+        **routed("single_task", "routing_complete_single_task", cost),
+        **turn_update(state),
+        "plan": Plan(tasks=[task])
+    }
+
+def planner_node(state: AgentState):
+    """
+    Analyzes the user request and generates a plan of tasks.
+    """
+    messages = state["messages"]
     
     planner_prompt = (
         "You are a Planner Agent. Your job is to break down the user's request into a set of tasks. "
@@ -117,21 +301,24 @@ def planner_node(state: AgentState):
         "- Be granular. 'Research X and Calculate Y' should be two tasks."
     )
     
-    planner_llm = llm_planner.with_structured_output(Plan)
+    planner_llm = llm_planner.with_structured_output(Plan, include_raw=True)
     
     # Pass the entire message history to the planner so it has context
     # We prepend the system prompt to the history
     planner_messages = [SystemMessage(content=planner_prompt)] + messages
     
-    plan = planner_llm.invoke(planner_messages)
+    output = planner_llm.invoke(planner_messages)
+    plan = output["parsed"]
+    if plan is None:
+        raise ValueError(f"Planner returned no plan: {output['parsing_error']}")
     
     if plan.response:
         print(colored(f"   [Planner]: Direct Response: {plan.response}", "cyan", attrs=['bold']))
         return {
+            **turn_update(state),
+            "usage": usage_update(PLANNER_MODEL, output["raw"]),
             "plan": plan, 
             "messages": [AIMessage(content=plan.response)], 
-            "results": {"__turn__": True} if clear_results else {},
-            "turn_id": current_turn,
             "steps": ["planning_complete_direct"]
         }
     
@@ -141,9 +328,9 @@ def planner_node(state: AgentState):
     
     # Signal turn change if needed
     return {
+        **turn_update(state),
+        "usage": usage_update(PLANNER_MODEL, output["raw"]),
         "plan": plan, 
-        "results": {"__turn__": True} if clear_results else {},
-        "turn_id": current_turn,
         "steps": ["planning_complete"]
     }
 
@@ -230,6 +417,7 @@ def research_agent(state: WorkerInput):
         msg = research_llm.invoke([SystemMessage(content=system_prompt), HumanMessage(content="Please execute the task.")])
         
         result = msg.content
+        usage = usage_update(FLASH_MODEL, msg)
         if msg.tool_calls:
             # Execute tool
             tool_call = msg.tool_calls[0]
@@ -244,10 +432,11 @@ def research_agent(state: WorkerInput):
                         ToolMessage(content=str(tool_output), tool_call_id=tool_call["id"])
                     ])
                     result = final_msg.content
+                    usage = usage_update(FLASH_MODEL, msg, final_msg)
                 except Exception as tool_error:
                     result = f"I encountered an error while searching: {str(tool_error)}. I cannot complete this task."
                 
-        return {"results": {task.id: result}}
+        return {"results": {task.id: result}, "usage": usage}
     except Exception as e:
         error_msg = f"ResearchAgent encountered an error: {str(e)}. Unable to complete task '{task.description}'."
         print(colored(f"   [ERROR] {error_msg}", "red"))
@@ -284,7 +473,7 @@ def ops_agent(state: WorkerInput):
         
         #If no tool calls, return the response
         if not response.tool_calls:
-            return {"results": {task.id: response.content}}
+            return {"results": {task.id: response.content}, "usage": usage_update(FLASH_MODEL, response)}
         
         # Execute tools
         tool_results = []
@@ -306,12 +495,29 @@ def ops_agent(state: WorkerInput):
         messages.extend(tool_results)
         final_response = ops_llm.invoke(messages)
         
-        return {"results": {task.id: final_response.content}}
+        return {"results": {task.id: final_response.content}, "usage": usage_update(FLASH_MODEL, response, final_response)}
     except Exception as e:
         error_msg = f"OpsAgent encountered an error: {str(e)}. Unable to complete task '{task.description}'."
         print(colored(f"   [ERROR] {error_msg}", "red"))
         return {"results": {task.id: error_msg}}
 
+def record_turn(state: AgentState, status: str, cost: float = 0.0):
+    """
+    Records the finished turn under its final route, once, with the total
+    latency and cost of every LLM call in it (router share included).
+    A FAIL goes through retry, so the turn is recorded when it finally ends.
+    """
+    if status == "FAIL" or "turn_started" not in state:
+        return
+    usage = state.get("usage") or {}
+    record_route(
+        state.get("route", "multi_task"),
+        time.time() - state["turn_started"],
+        usage.get("cost_usd", 0.0) + cost,
+        router_latency=usage.get("router_latency_s", 0.0),
+        router_cost=usage.get("router_cost_usd", 0.0)
+    )
+
 def verification_node(state: AgentState):
     """
     Audits the answer against the retrieved context (if any).
@@ -337,6 +543,7 @@ def verification_node(state: AgentState):
             break
             
     if not context or context == "No relevant context found.":
+        record_turn(state, "SKIPPED")
         return {"steps": ["verification_skipped_no_context"], "verification_status": "SKIPPED"}
 
     verification_prompt = (
@@ -354,8 +561,10 @@ def verification_node(state: AgentState):
     if "VERIFICATION STATUS: FAIL" in response.content:
         status = "FAIL"
     
+    record_turn(state, status, estimate_cost(FLASH_MODEL, response))
     return {
         "messages": [AIMessage(content=response.content)], 
+        "usage": usage_update(FLASH_MODEL, response),
         "steps": ["verification_complete"],
         "verification_status": status
     }
@@ -380,6 +589,7 @@ def retry_node(state: AgentState):
     
     return {
         "messages": [HumanMessage(content=f"CRITIQUE: {response.content}")],
+        "usage": usage_update(FLASH_MODEL, response),
         "steps": ["retry_triggered"]
     }
 
@@ -413,12 +623,13 @@ def synthesis_node(state: AgentState):
     
     response = llm_flash.invoke([SystemMessage(content=synthesis_prompt), HumanMessage(content=user_message)])
     
-    return {"messages": [response], "steps": ["synthesis_complete"]}
+    return {"messages": [response], "usage": usage_update(FLASH_MODEL, response), "steps": ["synthesis_complete"]}
 
 # 4. Build Graph
 workflow = StateGraph(AgentState)
 
 # Nodes
+workflow.add_node("router_node", router_node)
 workflow.add_node("planner_node", planner_node)
 workflow.add_node("scheduler_node", scheduler_node)
 workflow.add_node("research_agent", research_agent)
@@ -428,7 +639,7 @@ workflow.add_node("verification_node", verification_node)
 workflow.add_node("retry_node", retry_node)
 
 # Edges
-workflow.add_edge(START, "planner_node")
+workflow.add_edge(START, "router_node")
 
 def route_planner(state):
     plan = state["plan"]
@@ -436,6 +647,21 @@ def route_planner(state):
         return "verification_node"
     return "scheduler_node"
 
+def route_router(state):
+    if state.get("route") in ["direct", "single_task"]:
+        return route_planner(state)
+    return "planner_node"
+
+workflow.add_conditional_edges(
+    "router_node",
+    route_router,
+    {
+        "planner_node": "planner_node",
+        "verification_node": "verification_node",
+        "scheduler_node": "scheduler_node"
+    }
+)
+
 workflow.add_conditional_edges(
     "planner_node",
     route_planner,
@@ -487,10 +713,37 @@ conn = sqlite3.connect("checkpoints.sqlite", check_same_thread=False)
 memory = SqliteSaver(conn)
 app = workflow.compile(checkpointer=memory)
 
+# Nodes whose LLM tokens are forwarded to the client while they are generated
+STREAMED_NODES = {"synthesis_node"}
+
+def chunk_text(chunk: AIMessageChunk) -> str:
+    if isinstance(chunk.content, str):
+        return chunk.content
+    # Gemini may return a list of content parts
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in chunk.content)
+
+def stream_turn(inputs: dict, config: dict):
+    """
+    Runs one conversation turn.
+    Yields ("token", text) for synthesis tokens as they are generated and
+    ("update", (node_name, update)) whenever a node finishes, so the REPL
+    (or a server) can show the answer before verification has run.
+    """
+    for mode, payload in app.stream(inputs, config=config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") in STREAMED_NODES and isinstance(chunk, AIMessageChunk):
+                text = chunk_text(chunk)
+                if text:
+                    yield "token", text
+            continue
+        for key, value in payload.items():
+            yield "update", (key, value)
+
 def initialize_knowledge_base():
     # Load data once at startup
-    if not kg.graph.nodes:
+    if not kg.is_ready:
         print("⚠️ Knowledge Graph not found. Ingesting data...")
         kg.ingest("data/")
     else:
-        print(f"✅ Knowledge Graph loaded with {len(kg.graph.nodes)} nodes.")
\ No newline at end of file
+        print(f"✅ Knowledge Graph loaded with {kg.node_count} nodes.")
\ No newline at end of file
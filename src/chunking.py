@@ -0,0 +1,261 @@
+import re
+import random
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^(`{3,}|~{3,}|\$\$)")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text)
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count (words and punctuation), close enough to size chunks
+    without pulling in a model-specific tokenizer.
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+def fence_opener(line: str) -> Optional[str]:
+    """
+    Returns the marker of a fenced block opened on this line, or None.
+    `$$...$$` on a single line is inline display math, not a fence.
+    """
+    stripped = line.strip()
+    match = FENCE_PATTERN.match(stripped)
+    if not match:
+        return None
+    if match.group(1) == "$$" and len(stripped) > 2 and stripped.endswith("$$"):
+        return None
+    return match.group(1)
+
+def closes_fence(line: str, opener: str) -> bool:
+    # Code fences close on a bare run of the same character at least as long as the opener
+    stripped = line.strip()
+    if opener == "$$":
+        return stripped.endswith("$$")
+    return len(stripped) >= len(opener) and set(stripped) == {opener[0]}
+
+class MarkdownChunker:
+    """
+    Splits markdown by heading/section, then packs whole blocks (paragraphs,
+    lists, tables, fenced code/math) into chunks of at most `chunk_tokens`.
+    Each chunk carries its heading path, e.g. "Nexus-Flash-Lite > 6. Pricing".
+    Packed chunks do not overlap: blocks are kept whole instead. `overlap_tokens`
+    only applies between the word windows of a single line longer than `chunk_tokens`.
+    """
+    def __init__(self, chunk_tokens: int = 256, overlap_tokens: int = 32, max_heading_level: int = 3):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_heading_level = max_heading_level
+
+    def split(self, text: str, source: str) -> List[Document]:
+        docs = []
+        for heading_path, lines in self._sections(text):
+            for content in self._pack(self._blocks(lines)):
+                docs.append(Document(
+                    page_content=content,
+                    metadata={"source": source, "heading_path": " > ".join(heading_path)}
+                ))
+        return docs
+
+    def _sections(self, text: str) -> List[Tuple[List[str], List[str]]]:
+        sections = []
+        stack = [] # [(level, title)]
+        current = []
+        fence = None
+        for line in text.splitlines():
+            if fence:
+                if closes_fence(line, fence):
+                    fence = None
+                current.append(line)
+                continue
+            fence = fence_opener(line)
+            match = None if fence else HEADING_PATTERN.match(line)
+            if match and len(match.group(1)) <= self.max_heading_level:
+                # Heading-only sections (e.g. a document title) are folded into the next one
+                if any(l.strip() and not HEADING_PATTERN.match(l) for l in current):
+                    sections.append(([title for _, title in stack], current))
+                    current = []
+                level = len(match.group(1))
+                stack = [(l, t) for l, t in stack if l < level] + [(level, match.group(2).strip("*_ "))]
+                current.append(line)
+            else:
+                current.append(line)
+        if any(l.strip() for l in current):
+            sections.append(([title for _, title in stack], current))
+        return sections
+
+    def _blocks(self, lines: List[str]) -> List[Tuple[str, str]]:
+        """
+        Groups section lines into ("table" | "fence" | "text", content) blocks.
+        """
+        blocks = []
+        current, kind, fence = [], None, None
+
+        def flush():
+            if current and any(l.strip() for l in current):
+                blocks.append((kind or "text", "\n".join(current).strip("\n")))
+            current.clear()
+
+        for line in lines:
+            stripped = line.strip()
+            if kind == "fence":
+                current.append(line)
+                if closes_fence(line, fence):
+                    flush()
+                    kind = None
+                continue
+            fence = fence_opener(line)
+            if fence:
+                flush()
+                kind = "fence"
+                current.append(line)
+                continue
+            line_kind = "table" if stripped.startswith("|") else "text"
+            if not stripped or line_kind != kind:
+                flush()
+                kind = line_kind if stripped else None
+            if stripped:
+                current.append(line)
+        flush()
+        return blocks
+
+    def _pack(self, blocks: List[Tuple[str, str]]) -> List[str]:
+        chunks = []
+        current, current_tokens = [], 0
+        for kind, content in blocks:
+            tokens = count_tokens(content)
+            if tokens > self.chunk_tokens:
+                # Headings alone are not a chunk, they lead the first piece instead,
+                # so the block is split with their tokens taken off the budget
+                headings_only = current and all(HEADING_PATTERN.match(l) for block in current for l in block.split("\n") if l.strip())
+                carry = current if headings_only and current_tokens < self.chunk_tokens // 2 else []
+                if current and not carry:
+                    chunks.append("\n\n".join(current))
+                limit = self.chunk_tokens - count_tokens("\n\n".join(carry))
+                pieces = self._split_table(content, limit) if kind == "table" else self._split_text(content, limit)
+                if carry:
+                    pieces[0] = "\n\n".join(carry + [pieces[0]])
+                current, current_tokens = [], 0
+                chunks.extend(pieces)
+                continue
+            if current and current_tokens + tokens > self.chunk_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(content)
+            current_tokens += tokens
+        if current:
+            chunks.append("\n\n".join(current))
+        return chunks
+
+    def _split_table(self, content: str, limit: int) -> List[str]:
+        # Repeat the header row(s) in every piece so each chunk is a readable table
+        rows = content.split("\n")
+        header = rows[:2] if len(rows) > 2 and set(rows[1].replace("|", "").strip()) <= set(":- ") else rows[:1]
+        header_tokens = count_tokens("\n".join(header))
+        pieces, current, current_tokens = [], [], header_tokens
+        for row in rows[len(header):]:
+            row_tokens = count_tokens(row)
+            if current and current_tokens + row_tokens > limit:
+                pieces.append("\n".join(header + current))
+                current, current_tokens = [], header_tokens
+            current.append(row)
+            current_tokens += row_tokens
+        if current:
+            pieces.append("\n".join(header + current))
+        return pieces
+
+    def _split_text(self, content: str, limit: int) -> List[str]:
+        # Oversized prose/lists are packed line by line, single oversized lines
+        # fall back to a word window with overlap
+        pieces, current, current_tokens = [], [], 0
+        for line in content.split("\n"):
+            line_tokens = count_tokens(line)
+            if current and current_tokens + line_tokens > limit:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            if line_tokens > limit:
+                pieces.extend(self._split_words(line, limit))
+                continue
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            pieces.append("\n".join(current))
+        return pieces
+
+    def _split_words(self, line: str, limit: int) -> List[str]:
+        words = line.split()
+        pieces, start = [], 0
+        while start < len(words):
+            end, tokens = start, 0
+            while end < len(words) and (tokens + count_tokens(words[end]) <= limit or end == start):
+                tokens += count_tokens(words[end])
+                end += 1
+            pieces.append(" ".join(words[start:end]))
+            if end >= len(words):
+                break
+            # Step back so consecutive pieces share roughly `overlap_tokens`
+            back, overlap = end, 0
+            while back > start + 1 and overlap < self.overlap_tokens:
+                back -= 1
+                overlap += count_tokens(words[back])
+            start = back
+        return pieces
+
+class MinHashDeduplicator:
+    """
+    Near-duplicate detection with MinHash signatures and LSH banding.
+    Signatures are deterministic (fixed seed, blake2b shingle hashes), so the
+    same text always collapses onto the same canonical chunk.
+    """
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, shingle_size: int = 5, threshold: float = 0.85, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        rng = random.Random(seed)
+        self._a = np.array([rng.randrange(1, self.PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, self.PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._buckets: List[Dict[Tuple[int, ...], List[str]]] = [dict() for _ in range(bands)]
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        tokens = [t.lower() for t in tokenize(text)]
+        size = min(self.shingle_size, len(tokens)) or 1
+        shingles = {" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") % self.PRIME for s in shingles],
+            dtype=np.uint64
+        )
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % self.PRIME
+        # Values are below PRIME < 2^31, uint32 halves what ingest workers ship back
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def add(self, key: str, signature: np.ndarray) -> Optional[str]:
+        """
+        Registers a chunk. Returns the key of an earlier near-duplicate if one
+        exists (the chunk is then not indexed), otherwise None.
+        """
+        band_keys = [tuple(signature[b * self.rows:(b + 1) * self.rows].tolist()) for b in range(self.bands)]
+        candidates = []
+        for band, band_key in enumerate(band_keys):
+            for candidate in self._buckets[band].get(band_key, []):
+                if candidate not in candidates:
+                    candidates.append(candidate)
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return candidate
+
+        self._signatures[key] = signature
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band].setdefault(band_key, []).append(key)
+        return None
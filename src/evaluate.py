@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import contextlib
+import numpy as np
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.graph_rag import KnowledgeGraphRetriever, LocalHashingEmbeddings
+from src.chunking import count_tokens
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_labels(path: str) -> list:
+    with open(path) as f:
+        return json.load(f)
+
+def hit_sources(hit: dict) -> set:
+    # A collapsed chunk stands in for every file it was found in
+    return {hit["source"], *hit.get("duplicates", [])}
+
+def evaluate_config(kg: KnowledgeGraphRetriever, labels: list, k: int, hops: int, repeats: int = 3) -> dict:
+    """
+    Runs every labelled question through the retriever and scores the result.
+    recall@k: share of labelled sources among the k vector-search entries.
+    context recall: share of labelled sources anywhere in the returned context,
+    i.e. including chunks reached through graph hops.
+    MRR: reciprocal rank of the first vector-search entry from a labelled source.
+    """
+    recalls, context_recalls, reciprocal_ranks, context_tokens, latencies = [], [], [], [], []
+    for label in labels:
+        expected = set(label["sources"])
+        for _ in range(repeats):
+            started = time.perf_counter()
+            hits = kg.search(label["question"], k=k, hops=hops)
+            context = KnowledgeGraphRetriever.format_context(hits)
+            latencies.append(time.perf_counter() - started)
+
+        entries = [hit for hit in hits if hit["entry_id"] is None]
+        retrieved = set().union(*[hit_sources(hit) for hit in entries]) if entries else set()
+        recalls.append(len(expected & retrieved) / len(expected))
+        returned = set().union(*[hit_sources(hit) for hit in hits]) if hits else set()
+        context_recalls.append(len(expected & returned) / len(expected))
+
+        rank = next((i + 1 for i, hit in enumerate(entries) if hit_sources(hit) & expected), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        context_tokens.append(count_tokens(context))
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "recall": float(np.mean(recalls)),
+        "context_recall": float(np.mean(context_recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "context_tokens": float(np.mean(context_tokens)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def sweep(data_dir: str, labels: list, chunk_sizes: list, backends: list, ks: list, hops_values: list, repeats: int) -> list:
+    """
+    Builds one index per (chunk size, backend) with the offline embedder and
+    evaluates every (k, hops) combination against it.
+    """
+    embeddings = LocalHashingEmbeddings()
+    results = []
+    for chunk_tokens, backend in itertools.product(chunk_sizes, backends):
+        with tempfile.TemporaryDirectory() as storage_dir:
+            kg = KnowledgeGraphRetriever(storage_dir=storage_dir, chunk_tokens=chunk_tokens, vector_backend=backend, embeddings=embeddings)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                kg.ingest(data_dir)
+            for k, hops in itertools.product(ks, hops_values):
+                metrics = evaluate_config(kg, labels, k=k, hops=hops, repeats=repeats)
+                results.append({"chunk_tokens": chunk_tokens, "backend": backend, "k": k, "hops": hops, "chunks": kg.node_count, **metrics})
+    return results
+
+def print_report(results: list):
+    header = f"{'chunk':>6} {'backend':>10} {'k':>3} {'hops':>4} {'chunks':>6} {'recall@k':>9} {'ctx rec':>8} {'MRR':>6} {'ctx tok':>8} {'p50 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['chunk_tokens']:>6} {r['backend']:>10} {r['k']:>3} {r['hops']:>4} {r['chunks']:>6} "
+              f"{r['recall']:>9.3f} {r['context_recall']:>8.3f} {r['mrr']:>6.3f} {r['context_tokens']:>8.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval quality vs latency sweep over data/.")
+    parser.add_argument("--labels", default=os.path.join(ROOT_DIR, "eval", "retrieval_labels.json"))
+    parser.add_argument("--data", default=os.path.join(ROOT_DIR, "data"))
+    parser.add_argument("--chunk-tokens", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--backends", nargs="+", default=["faiss", "quantized"], choices=["faiss", "quantized"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--hops", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per question for latency percentiles.")
+    parser.add_argument("--output", help="Also write the results as JSON to this path.")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    print(f"📏 Evaluating {len(labels)} labelled questions over {args.data}")
+    results = sweep(args.data, labels, args.chunk_tokens, args.backends, args.k, args.hops, args.repeats)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
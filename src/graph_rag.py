@@ -1,11 +1,52 @@
 import os
+import re
+import json
 import pickle
+import shutil
+import hashlib
+import numpy as np
 import networkx as nx
-from typing import List
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
 from google import genai
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.chunking import MarkdownChunker, MinHashDeduplicator
+from src.vector_store import QuantizedVectorStore
+
+CONCEPT_KEYWORDS = ["LangChain", "Gemini", "Dependency", "Payment", "Auth"]
+
+# Bump when chunking, node layout or index scoring change. Saved indexes with
+# another (or no) version are treated as missing, so the app re-ingests.
+# 2: heading-aware chunks with heading_path, normalize_L2 FAISS index.
+INDEX_FORMAT_VERSION = 2
+
+# Only used for signatures, built once per (worker) process. Parameters match the merge side.
+SIGNATURE_HASHER = MinHashDeduplicator()
+
+def process_file(path: str, chunker: MarkdownChunker) -> List[dict]:
+    """
+    Reads, chunks and extracts concepts for one file. Runs in ingest worker
+    processes (the chunker is pickled along with the path), so it only returns
+    plain, picklable chunk records. Chunk ids depend only on the file name and
+    content, so they are stable across runs.
+    """
+    filename = os.path.basename(path)
+    with open(path, "r") as f:
+        content = f.read()
+    records = []
+    for i, chunk in enumerate(chunker.split(content, source=filename)):
+        records.append({
+            "id": f"{filename}_{i}",
+            "source": filename,
+            "heading_path": chunk.metadata["heading_path"],
+            "content": chunk.page_content,
+            "concepts": [kw for kw in CONCEPT_KEYWORDS if kw in chunk.page_content],
+            "signature": SIGNATURE_HASHER.signature(chunk.page_content),
+        })
+    return records
 
 # Custom Embeddings Wrapper for google-genai
 class GoogleGenAIEmbeddingsWrapper(Embeddings):
@@ -33,70 +74,155 @@ class GoogleGenAIEmbeddingsWrapper(Embeddings):
         )
         return result.embeddings[0].values
 
+class LocalHashingEmbeddings(Embeddings):
+    """
+    Offline embedder: signed feature hashing of word unigrams and bigrams.
+    Deterministic and dependency-free, used for evaluation runs without API access.
+    """
+    def __init__(self, dimensions: int = 1024):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        words = [w.lower() for w in re.findall(r"\w+", text)]
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[digest % self.dimensions] += 1.0 if (digest >> 63) else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector)) # sublinear term frequency
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
 class KnowledgeGraphRetriever:
-    def __init__(self, storage_dir: str = "graph"):
+    def __init__(self, storage_dir: str = "graph", chunk_tokens: int = 256, dedup_threshold: float = 0.85,
+                 vector_backend: str = "faiss", quantization: str = "int8", embeddings: Optional[Embeddings] = None):
+        """
+        vector_backend: "faiss" (float32 index + pickled docstore) or "quantized"
+        (memory-mapped int8/float16 codes with exact rescoring, see QuantizedVectorStore).
+        """
+        if vector_backend not in ["faiss", "quantized"]:
+            raise ValueError(f"Unknown vector backend '{vector_backend}'")
         self.storage_dir = storage_dir
-        self.graph_path = os.path.join(storage_dir, "knowledge_graph.gpickle")
-        self.vector_store_path = os.path.join(storage_dir, "vector_store")
+        self.vector_backend = vector_backend
+        self.quantization = quantization
+        # Graph and index are built together from the same chunks, so each backend keeps its own graph
+        if vector_backend == "faiss":
+            self.graph_path = os.path.join(storage_dir, "knowledge_graph.gpickle")
+            self.vector_store_path = os.path.join(storage_dir, "vector_store")
+        else:
+            self.graph_path = os.path.join(storage_dir, "knowledge_graph_quantized.gpickle")
+            self.vector_store_path = os.path.join(storage_dir, "quantized_store")
+        self.format_path = os.path.join(self.vector_store_path, "format.json")
         
         self.graph = nx.Graph()
         self.vector_store = None
-        self.embeddings = GoogleGenAIEmbeddingsWrapper(model="gemini-embedding-001")
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        self.embeddings = embeddings or GoogleGenAIEmbeddingsWrapper(model="gemini-embedding-001")
+        self.chunker = MarkdownChunker(chunk_tokens=chunk_tokens)
+        self.dedup_threshold = dedup_threshold
         
         # Load if exists
         self.load()
 
-    def ingest(self, directory_path: str):
+    def ingest(self, directory_path: str, filenames: Optional[List[str]] = None, workers: int = 1):
+        """
+        Builds the index and graph from the .md/.txt files in `directory_path`
+        (or only `filenames`, when given) and saves them to `storage_dir`.
+        With workers > 1, reading, chunking, concept extraction and MinHash
+        signatures run on a process pool; results are merged in file order.
+        """
         print("⚙️  Ingesting and building Knowledge Graph...")
-        docs = []
         
         # 1. Read and Chunk
         if not os.path.exists(directory_path):
             print(f"⚠️ Directory {directory_path} not found.")
             return
 
-        for filename in os.listdir(directory_path):
-            if filename.endswith(".md") or filename.endswith(".txt"):
-                path = os.path.join(directory_path, filename)
-                with open(path, "r") as f:
-                    content = f.read()
-                    file_chunks = self.text_splitter.create_documents(
-                        [content], 
-                        metadatas=[{"source": filename}]
-                    )
-                    for i, chunk in enumerate(file_chunks):
-                        chunk_id = f"{filename}_{i}"
-                        chunk.metadata["id"] = chunk_id
-                        docs.append(chunk)
-
-        if not docs:
+        if filenames is None:
+            filenames = [f for f in os.listdir(directory_path) if f.endswith(".md") or f.endswith(".txt")]
+        paths = [os.path.join(directory_path, filename) for filename in sorted(filenames)]
+
+        if workers > 1 and len(paths) > 1:
+            print(f"🧵 Processing {len(paths)} files on {workers} worker processes...")
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                per_file = list(pool.map(
+                    process_file, paths, repeat(self.chunker),
+                    chunksize=max(1, len(paths) // (workers * 4))
+                ))
+        else:
+            per_file = [process_file(path, self.chunker) for path in paths]
+        records = [record for file_records in per_file for record in file_records]
+
+        if not records:
             print("No documents found.")
             return
 
-        # 2. Build Vector Store
-        print(f"📊 Embedding {len(docs)} chunks...")
-        self.vector_store = FAISS.from_documents(docs, self.embeddings)
-        self.vector_store.save_local(self.vector_store_path)
+        # 2. Collapse near-duplicate chunks (boilerplate repeated across files)
+        deduplicator = MinHashDeduplicator(threshold=self.dedup_threshold)
+        unique_docs = []
+        aliases = {} # {duplicate_id: canonical_id}
+        by_id = {}
+        for record in records:
+            chunk_id = record["id"]
+            canonical_id = deduplicator.add(chunk_id, record["signature"])
+            if canonical_id:
+                aliases[chunk_id] = canonical_id
+                canonical = by_id[canonical_id]
+                if record["source"] != canonical.metadata["source"] and record["source"] not in canonical.metadata["duplicates"]:
+                    canonical.metadata["duplicates"].append(record["source"])
+                continue
+            doc = Document(
+                page_content=record["content"],
+                metadata={"id": chunk_id, "source": record["source"], "heading_path": record["heading_path"], "duplicates": []}
+            )
+            by_id[chunk_id] = doc
+            unique_docs.append(doc)
+        if aliases:
+            print(f"🧹 Collapsed {len(aliases)} near-duplicate chunks.")
 
-        # 3. Build Graph Structure (NetworkX)
+        # 3. Build Vector Store
+        print(f"📊 Embedding {len(unique_docs)} chunks...")
+        if self.vector_backend == "quantized":
+            QuantizedVectorStore.from_documents(unique_docs, self.embeddings, quantization=self.quantization).save_local(self.vector_store_path)
+            # Serve from disk like a cold start, so chunk text is not kept in memory
+            self.vector_store = QuantizedVectorStore.load_local(self.vector_store_path, self.embeddings)
+        else:
+            self.vector_store = FAISS.from_documents(unique_docs, self.embeddings, normalize_L2=True)
+            self.vector_store.save_local(self.vector_store_path)
+
+        # 4. Build Graph Structure (NetworkX)
+        # The quantized backend keeps chunk text only in its docstore, nodes store the docstore row
         self.graph = nx.Graph() # Reset graph
-        for doc in docs:
+        for row, doc in enumerate(unique_docs):
             node_id = doc.metadata["id"]
-            self.graph.add_node(node_id, content=doc.page_content, source=doc.metadata["source"])
-
-        # Create Edges
-        for i in range(len(docs) - 1):
-            curr = docs[i]
-            next_doc = docs[i+1]
-            if curr.metadata["source"] == next_doc.metadata["source"]:
-                self.graph.add_edge(curr.metadata["id"], next_doc.metadata["id"], relation="next_chunk")
+            text = {"row": row} if self.vector_backend == "quantized" else {"content": doc.page_content}
+            self.graph.add_node(
+                node_id,
+                source=doc.metadata["source"],
+                heading_path=doc.metadata["heading_path"],
+                duplicates=doc.metadata["duplicates"],
+                **text
+            )
+
+        # Create Edges (collapsed chunks keep their neighbours through the canonical node)
+        for i in range(len(records) - 1):
+            curr = records[i]
+            next_record = records[i+1]
+            curr_id = aliases.get(curr["id"], curr["id"])
+            next_id = aliases.get(next_record["id"], next_record["id"])
+            if curr_id == next_id:
+                continue
+            if curr["source"] == next_record["source"]:
+                self.graph.add_edge(curr_id, next_id, relation="next_chunk")
             
             # Simple keyword linking
-            keywords = ["LangChain", "Gemini", "Dependency", "Payment", "Auth"]
-            for kw in keywords:
-                if kw in curr.page_content and kw in next_doc.page_content:
-                    self.graph.add_edge(curr.metadata["id"], next_doc.metadata["id"], relation="shared_concept")
+            if set(curr["concepts"]) & set(next_record["concepts"]):
+                self.graph.add_edge(curr_id, next_id, relation="shared_concept")
 
         # Save Graph
         if not os.path.exists(self.storage_dir):
@@ -104,51 +230,139 @@ class KnowledgeGraphRetriever:
         
         with open(self.graph_path, "wb") as f:
             pickle.dump(self.graph, f)
+        # Written last, an interrupted ingest leaves the index marked as not built
+        with open(self.format_path, "w") as f:
+            json.dump({"format_version": INDEX_FORMAT_VERSION}, f)
 
         print(f"✅ Graph Built: {len(self.graph.nodes)} nodes, {len(self.graph.edges)} edges.")
         print(f"💾 Saved to {self.storage_dir}")
 
     def load(self):
+        format_version = None
+        if os.path.exists(self.format_path):
+            with open(self.format_path) as f:
+                format_version = json.load(f).get("format_version")
+        if format_version != INDEX_FORMAT_VERSION:
+            if os.path.exists(self.vector_store_path) or os.path.exists(self.graph_path):
+                print(f"⚠️ Index in {self.storage_dir} was built by an older version (format {format_version}, expected {INDEX_FORMAT_VERSION}), re-ingest needed.")
+            return
+
         if os.path.exists(self.graph_path):
             with open(self.graph_path, "rb") as f:
                 self.graph = pickle.load(f)
         
         if os.path.exists(self.vector_store_path):
             try:
-                self.vector_store = FAISS.load_local(self.vector_store_path, self.embeddings, allow_dangerous_deserialization=True)
+                if self.vector_backend == "quantized":
+                    self.vector_store = QuantizedVectorStore.load_local(self.vector_store_path, self.embeddings)
+                else:
+                    self.vector_store = FAISS.load_local(self.vector_store_path, self.embeddings, allow_dangerous_deserialization=True, normalize_L2=True)
             except Exception as e:
                 print(f"⚠️ Could not load vector store: {e}")
 
-    def retrieve(self, query: str, hops: int = 1) -> str:
+    def clear(self):
+        """
+        Drops the saved index and graph for this backend, e.g. when none of the
+        files it was built from exist any more.
+        """
+        if os.path.exists(self.vector_store_path):
+            shutil.rmtree(self.vector_store_path)
+        if os.path.exists(self.graph_path):
+            os.remove(self.graph_path)
+        self.graph = nx.Graph()
+        self.vector_store = None
+
+    @staticmethod
+    def _describe_source(node_data: dict) -> str:
+        description = node_data["source"]
+        if node_data.get("heading_path"):
+            description += f" § {node_data['heading_path']}"
+        if node_data.get("duplicates"):
+            description += f" (also in: {', '.join(node_data['duplicates'])})"
+        return description
+
+    def node_content(self, node_id: str) -> str:
+        node_data = self.graph.nodes[node_id]
+        if "content" in node_data:
+            return node_data["content"]
+        return self.vector_store.document(node_data["row"]).page_content
+
+    def node_hit(self, node_id: str, score: Optional[float], entry_id: str = None) -> dict:
+        node_data = self.graph.nodes[node_id]
+        return {
+            "id": node_id,
+            "source": node_data["source"],
+            "description": self._describe_source(node_data),
+            "duplicates": node_data.get("duplicates", []),
+            "content": self.node_content(node_id),
+            "score": score,
+            "entry_id": entry_id, # None for vector-search hits, the entry node for linked context
+        }
+
+    def search(self, query: str, k: int = 2, hops: int = 1) -> List[dict]:
+        """
+        Vector search for `k` entry nodes, each followed by its graph neighbours
+        within `hops`. Scores are relevance scores (higher is better).
+        """
         if not self.vector_store:
-            return "Knowledge base is empty."
+            return []
 
         # Step 1: Vector Search
-        results = self.vector_store.similarity_search(query, k=2)
-        if not results:
-            return "No relevant context found."
+        if self.vector_backend == "quantized":
+            results = self.vector_store.similarity_search_with_relevance_scores(query, k=k)
+        else:
+            # The FAISS index is built with normalize_L2, so the squared L2 distance d
+            # of unit vectors gives cosine similarity as 1 - d/2, same scale as the
+            # quantized backend, which keeps scores comparable across shards
+            results = [(doc, 1.0 - float(distance) / 2) for doc, distance in self.vector_store.similarity_search_with_score(query, k=k)]
 
         # Step 2: Graph Traversal
-        final_context = []
+        hits = []
         visited_nodes = set()
 
-        for res in results:
+        for res, score in results:
             entry_id = res.metadata["id"]
             if entry_id in visited_nodes: continue
             
             if entry_id in self.graph.nodes:
-                node_data = self.graph.nodes[entry_id]
-                final_context.append(f"Source: {node_data['source']}\nContent: {node_data['content']}")
+                hits.append(self.node_hit(entry_id, score))
                 visited_nodes.add(entry_id)
             
             try:
                 neighbors = list(nx.bfs_tree(self.graph, source=entry_id, depth_limit=hops))
                 for n_id in neighbors:
                     if n_id != entry_id and n_id not in visited_nodes:
-                        node_data = self.graph.nodes[n_id]
-                        final_context.append(f"--- Linked Context (Source: {node_data['source']}) ---\n{node_data['content']}")
+                        hits.append(self.node_hit(n_id, score, entry_id=entry_id))
                         visited_nodes.add(n_id)
             except Exception:
                 pass
 
-        return "\n\n".join(final_context)
\ No newline at end of file
+        return hits
+
+    @staticmethod
+    def format_context(hits: List[dict]) -> str:
+        final_context = []
+        for hit in hits:
+            if hit["entry_id"] is None:
+                final_context.append(f"Source: {hit['description']}\nContent: {hit['content']}")
+            else:
+                final_context.append(f"--- Linked Context (Source: {hit['description']}) ---\n{hit['content']}")
+        return "\n\n".join(final_context)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.graph.nodes)
+
+    @property
+    def is_ready(self) -> bool:
+        # Both halves are needed to answer queries
+        return self.vector_store is not None and self.node_count > 0
+
+    def retrieve(self, query: str, hops: int = 1, k: int = 2) -> str:
+        if not self.vector_store:
+            return "Knowledge base is empty."
+
+        hits = self.search(query, k=k, hops=hops)
+        if not hits:
+            return "No relevant context found."
+        return self.format_context(hits)
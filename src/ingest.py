@@ -1,23 +1,36 @@
 import os
 import sys
+import argparse
 from dotenv import load_dotenv
 
 # Add src to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.graph_rag import KnowledgeGraphRetriever
+from src.sharded_rag import ShardedKnowledgeGraphRetriever
 
 def main():
     load_dotenv()
     
+    parser = argparse.ArgumentParser(description="Build the knowledge graph and vector index from data/.")
+    parser.add_argument("--sharded", action="store_true", help="Build the sharded knowledge base under graph/shards.")
+    parser.add_argument("--shard", action="append", help="Only rebuild this shard (repeatable, implies --sharded).")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for parsing, chunking and concept extraction (default: 1).")
+    args = parser.parse_args()
+    
     data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
     graph_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "graph")
     
     print(f"📂 Data Directory: {data_dir}")
     print(f"📂 Graph Output Directory: {graph_dir}")
     
-    kg = KnowledgeGraphRetriever(storage_dir=graph_dir)
-    kg.ingest(data_dir)
+    vector_backend = os.environ.get("VECTOR_BACKEND", "faiss")
+    if args.sharded or args.shard or os.environ.get("KB_SHARDED") == "1":
+        kg = ShardedKnowledgeGraphRetriever(storage_dir=os.path.join(graph_dir, "shards"), vector_backend=vector_backend)
+        kg.ingest(data_dir, shards=args.shard, workers=args.workers)
+    else:
+        kg = KnowledgeGraphRetriever(storage_dir=graph_dir, vector_backend=vector_backend)
+        kg.ingest(data_dir, workers=args.workers)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import fnmatch
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+from src.graph_rag import KnowledgeGraphRetriever, GoogleGenAIEmbeddingsWrapper
+
+# Default layout of data/ by team and product. Files matching no pattern go to DEFAULT_SHARD.
+SHARDS = {
+    "models": ["nexus_*", "embedding_*", "benchmark_*"],
+    "infrastructure": ["cluster_*", "vectordb_*", "edge_gateway_*", "deployment_*", "api_error_codes.*"],
+    "security": ["legacy_auth_*", "data_sanitization_*", "incident_response_*", "post_mortem_*"],
+    "business": ["cost_analysis_*", "project_*"],
+}
+DEFAULT_SHARD = "general"
+
+FILE_REFERENCE = re.compile(r"\b([\w\-]+\.(?:md|txt))\b")
+
+class QueryCacheEmbeddings(Embeddings):
+    """
+    Memoizes recent query embeddings so a fan-out over N shards embeds the query once.
+    """
+    def __init__(self, embeddings: Embeddings, max_size: int = 256):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._cache[text] = vector
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return vector
+
+class ShardedKnowledgeGraphRetriever:
+    """
+    Several independent KnowledgeGraphRetriever shards (own index, graph and
+    ingest lifecycle under `storage_dir/<shard>`), queried in parallel and
+    merged by score. Cross-shard edges point from a chunk to the first chunk of
+    a file it names that lives in another shard, and are stored in
+    `storage_dir/cross_edges.json`. At most `max_cross_hits` of them are
+    followed per entry, so sharding does not inflate the returned context.
+
+    Near-duplicate collapsing runs per shard: boilerplate repeated in files of
+    different shards is indexed once in each of those shards.
+    """
+    def __init__(self, storage_dir: str = os.path.join("graph", "shards"), shards: Dict[str, List[str]] = None,
+                 max_workers: Optional[int] = None, embeddings: Optional[Embeddings] = None, max_cross_hits: int = 1,
+                 **retriever_kwargs):
+        self.storage_dir = storage_dir
+        self.max_cross_hits = max_cross_hits
+        self.shard_patterns = shards or SHARDS
+        self.cross_edges_path = os.path.join(storage_dir, "cross_edges.json")
+        self.embeddings = QueryCacheEmbeddings(embeddings or GoogleGenAIEmbeddingsWrapper(model="gemini-embedding-001"))
+
+        names = list(self.shard_patterns) + [DEFAULT_SHARD]
+        self.shards = {
+            name: KnowledgeGraphRetriever(storage_dir=os.path.join(storage_dir, name), embeddings=self.embeddings, **retriever_kwargs)
+            for name in names
+        }
+        # Threads are enough: FAISS/numpy search and the embedding HTTP call release the GIL
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.shards))
+        self.cross_edges = {} # {node_id: [(shard, referenced node_id), ...]}, outgoing only
+        self.load_cross_edges()
+
+    @property
+    def shard_names(self) -> List[str]:
+        return list(self.shards)
+
+    @property
+    def node_count(self) -> int:
+        return sum(shard.node_count for shard in self.shards.values())
+
+    @property
+    def is_ready(self) -> bool:
+        return any(shard.is_ready for shard in self.shards.values())
+
+    def describe_shards(self) -> str:
+        # e.g. "'models' (nexus_*, embedding_*), ..., 'general' (any other file)"
+        described = [f"'{name}' ({', '.join(patterns)})" for name, patterns in self.shard_patterns.items()]
+        return ", ".join(described + [f"'{DEFAULT_SHARD}' (any other file)"])
+
+    def shard_for(self, filename: str) -> str:
+        for name, patterns in self.shard_patterns.items():
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+                return name
+        return DEFAULT_SHARD
+
+    def ingest(self, directory_path: str, shards: Optional[List[str]] = None, workers: int = 1):
+        """
+        (Re)builds the given shards, or all of them, then refreshes the cross-shard edges.
+        Shards not listed are left untouched, listed shards with no files are cleared.
+        """
+        selected = shards or self.shard_names
+        unknown = [name for name in selected if name not in self.shards]
+        if unknown:
+            raise ValueError(f"Unknown shard(s) {', '.join(unknown)}. Available shards: {', '.join(self.shard_names)}")
+
+        if not os.path.exists(directory_path):
+            print(f"⚠️ Directory {directory_path} not found.")
+            return
+
+        assignment = {name: [] for name in self.shards}
+        for filename in sorted(os.listdir(directory_path)):
+            if filename.endswith(".md") or filename.endswith(".txt"):
+                assignment[self.shard_for(filename)].append(filename)
+
+        for name in selected:
+            if not assignment[name]:
+                print(f"🧩 Shard '{name}': no files, clearing")
+                self.shards[name].clear()
+                continue
+            print(f"🧩 Shard '{name}': {len(assignment[name])} files")
+            self.shards[name].ingest(directory_path, filenames=assignment[name], workers=workers)
+
+        self.build_cross_edges()
+
+    def build_cross_edges(self):
+        # The first chunk still in the graph stands in for each file
+        file_entry = {}
+        for name, shard in self.shards.items():
+            for node_id in sorted(shard.graph.nodes, key=lambda n: int(n.rsplit("_", 1)[1])):
+                file_entry.setdefault(shard.graph.nodes[node_id]["source"], (name, node_id))
+
+        edges = []
+        for name, shard in self.shards.items():
+            for node_id in shard.graph.nodes:
+                for referenced in set(FILE_REFERENCE.findall(shard.node_content(node_id))):
+                    target = file_entry.get(referenced)
+                    if target and target[0] != name:
+                        edges.append([name, node_id, target[0], target[1]])
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+        with open(self.cross_edges_path, "w") as f:
+            json.dump(edges, f)
+        self._index_cross_edges(edges)
+        print(f"🔗 {len(edges)} cross-shard edges.")
+
+    def load_cross_edges(self):
+        if os.path.exists(self.cross_edges_path):
+            with open(self.cross_edges_path) as f:
+                self._index_cross_edges(json.load(f))
+
+    def _index_cross_edges(self, edges: List[list]):
+        # Only source -> referenced file: the reverse direction turns each file's
+        # first chunk into a hub linked to every chunk that mentions it
+        self.cross_edges = {}
+        for src_shard, src_id, dst_shard, dst_id in edges:
+            self.cross_edges.setdefault(src_id, []).append((dst_shard, dst_id))
+
+    def search(self, query: str, k: int = 2, hops: int = 1, shards: Optional[List[str]] = None) -> List[dict]:
+        """
+        Fans the query out to the selected shards in parallel and merges the top-k
+        entry hits by score. Each entry keeps its in-shard linked context and,
+        when hops > 0, up to `max_cross_hits` chunks of other-shard files it
+        references. Those are not scored (score None), they were not matched
+        against the query.
+        """
+        selected = [name for name in (shards or self.shard_names) if name in self.shards and self.shards[name].vector_store]
+        if not selected:
+            return []
+
+        # Embed once up front, shard searches then hit the query cache
+        self.embeddings.embed_query(query)
+        futures = {name: self.executor.submit(self.shards[name].search, query, k, hops) for name in selected}
+
+        entries, linked = [], {}
+        for name, future in futures.items():
+            for hit in future.result():
+                hit["shard"] = name
+                if hit["entry_id"] is None:
+                    entries.append(hit)
+                else:
+                    linked.setdefault(hit["entry_id"], []).append(hit)
+
+        hits, visited = [], set()
+        for entry in sorted(entries, key=lambda h: h["score"], reverse=True)[:k]:
+            if entry["id"] in visited:
+                continue
+            hits.append(entry)
+            visited.add(entry["id"])
+            for hit in linked.get(entry["id"], []):
+                if hit["id"] not in visited:
+                    hits.append(hit)
+                    visited.add(hit["id"])
+            if hops < 1:
+                continue
+            cross_hits = 0
+            for shard_name, node_id in self.cross_edges.get(entry["id"], []):
+                if cross_hits >= self.max_cross_hits:
+                    break
+                shard = self.shards[shard_name]
+                if node_id in visited or node_id not in shard.graph.nodes:
+                    continue
+                hit = shard.node_hit(node_id, None, entry_id=entry["id"])
+                hit["shard"] = shard_name
+                hits.append(hit)
+                visited.add(node_id)
+                cross_hits += 1
+        return hits
+
+    def retrieve(self, query: str, hops: int = 1, k: int = 2, shards: Optional[List[str]] = None) -> str:
+        if not any(shard.vector_store for shard in self.shards.values()):
+            return "Knowledge base is empty."
+
+        hits = self.search(query, k=k, hops=hops, shards=shards)
+        if not hits:
+            return "No relevant context found."
+        return KnowledgeGraphRetriever.format_context(hits)
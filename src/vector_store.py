@@ -0,0 +1,138 @@
+import os
+import json
+import numpy as np
+from typing import List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+class QuantizedVectorStore:
+    """
+    Cosine-similarity vector store with quantized first-pass search.
+
+    On disk (`save_local`):
+        codes.npy            int8 (with per-vector scales.npy) or float16 vectors, memory-mapped for the first pass
+        vectors.npy          full-precision float32 vectors, only the top candidates are read for rescoring
+        docstore.jsonl       one JSON document per line
+        docstore_offsets.npy byte offsets into docstore.jsonl, so documents are read on demand
+        meta.json            dimensions, count and quantization
+
+    Exposes the subset of the FAISS vector store API used by KnowledgeGraphRetriever.
+    """
+    QUANTIZATIONS = ("int8", "float16")
+
+    def __init__(self, embeddings: Embeddings, codes: np.ndarray, scales: Optional[np.ndarray], vectors: np.ndarray,
+                 quantization: str = "int8", documents: Optional[List[Document]] = None, path: Optional[str] = None,
+                 rescore_factor: int = 8, block_size: int = 65536):
+        self.embeddings = embeddings
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.block_size = block_size
+        self._documents = documents
+        self._offsets = None
+        self._docstore_path = None
+        if path is not None:
+            self._offsets = np.load(os.path.join(path, "docstore_offsets.npy"), mmap_mode="r")
+            self._docstore_path = os.path.join(path, "docstore.jsonl")
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def _quantize(cls, vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if quantization not in cls.QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization '{quantization}', expected one of {cls.QUANTIZATIONS}")
+        if quantization == "float16":
+            return vectors.astype(np.float16), None
+        # Symmetric per-vector scaling into [-127, 127]
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embedding: Embeddings, quantization: str = "int8", **kwargs) -> "QuantizedVectorStore":
+        vectors = np.asarray(embedding.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+        vectors = cls._normalize(vectors)
+        codes, scales = cls._quantize(vectors, quantization)
+        return cls(embedding, codes, scales, vectors, quantization=quantization, documents=list(documents), **kwargs)
+
+    def save_local(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), np.asarray(self.codes))
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        if self.scales is not None:
+            np.save(os.path.join(path, "scales.npy"), np.asarray(self.scales))
+
+        offsets = [0]
+        with open(os.path.join(path, "docstore.jsonl"), "wb") as f:
+            for i in range(len(self)):
+                doc = self.document(i)
+                line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(path, "docstore_offsets.npy"), np.asarray(offsets, dtype=np.uint64))
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"count": len(self), "dim": int(self.vectors.shape[1]), "quantization": self.quantization}, f)
+
+    @classmethod
+    def load_local(cls, path: str, embeddings: Embeddings, **kwargs) -> "QuantizedVectorStore":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        scales_path = os.path.join(path, "scales.npy")
+        return cls(
+            embeddings,
+            codes=np.load(os.path.join(path, "codes.npy"), mmap_mode="r"),
+            scales=np.load(scales_path) if os.path.exists(scales_path) else None,
+            vectors=np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+            quantization=meta["quantization"],
+            path=path,
+            **kwargs
+        )
+
+    def __len__(self) -> int:
+        return int(self.codes.shape[0])
+
+    def document(self, index: int) -> Document:
+        """
+        Returns the document at `index` (insertion order), read from docstore.jsonl when loaded from disk.
+        """
+        if self._documents is not None:
+            return self._documents[index]
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        with open(self._docstore_path, "rb") as f:
+            f.seek(start)
+            record = json.loads(f.read(end - start))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self), dtype=np.float32)
+        # Dequantize block by block so the mmap is streamed, not loaded whole
+        for start in range(0, len(self), self.block_size):
+            block = np.asarray(self.codes[start:start + self.block_size], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        if not len(self):
+            return []
+        q = self._normalize(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+        k = min(k, len(self))
+
+        # First pass on quantized codes, then exact rescoring of the top candidates
+        n_candidates = min(len(self), k * self.rescore_factor)
+        approximate = self._approximate_scores(q)
+        candidates = np.argpartition(-approximate, n_candidates - 1)[:n_candidates]
+        candidates.sort() # sequential reads from the memory-mapped file
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ q
+        best = np.argsort(-exact)[:k]
+        return [(self.document(int(candidates[i])), float(exact[i])) for i in best]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k=k)]